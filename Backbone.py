@@ -1,7 +1,10 @@
-from random import choices, randint, randrange, random, sample
+from functools import partial
+from random import sample
 from typing import List, Optional, Callable, Tuple
 
-Genome = List[int]
+import numpy as np
+
+Genome = np.ndarray
 Population = List[Genome]
 PopulateFunc = Callable[[], Population]
 FitnessFunc = Callable[[Genome], int]
@@ -11,30 +14,45 @@ MutationFunc = Callable[[Genome], Genome]
 PrinterFunc = Callable[[Population, int, FitnessFunc], None]
 
 
+def pack_genome(bits: np.ndarray) -> Genome:
+    padded = np.zeros(-(-len(bits) // 64) * 64, dtype=np.uint8)
+    padded[:len(bits)] = bits
+    return np.packbits(padded, bitorder="little").view("<u8")
+
+
+def unpack_genome(genome: Genome, length: int) -> np.ndarray:
+    return np.unpackbits(genome.astype("<u8").view(np.uint8), bitorder="little")[:length]
+
+
+def low_bits_mask(count: int, words: int) -> np.ndarray:
+    shift = np.clip(count - 64 * np.arange(words), 0, 64).astype(np.uint64)
+    return np.where(shift >= 64, np.uint64(0xFFFFFFFFFFFFFFFF), (np.uint64(1) << shift) - np.uint64(1))
+
+
 def generate_genome(length: int) -> Genome:
-    return choices([0, 1], k=length)
+    return pack_genome(np.random.randint(0, 2, size=length, dtype=np.uint8))
 
 
 def generate_population(size: int, genome_length: int) -> Population:
     return [generate_genome(genome_length) for _ in range(size)]
 
 
-def single_point_crossover(a: Genome, b: Genome) -> Tuple[Genome, Genome]:
+def single_point_crossover(a: Genome, b: Genome, length: int) -> Tuple[Genome, Genome]:
     if len(a) != len(b):
         raise ValueError("Genomes a and b must be of same length")
 
-    length = len(a)
     if length < 2:
         return a, b
 
-    p = randint(1, length - 1)
-    return a[0:p] + b[p:], b[0:p] + a[p:]
+    p = np.random.randint(1, length)
+    mask = low_bits_mask(p, len(a))
+    return (a & mask) | (b & ~mask), (b & mask) | (a & ~mask)
 
 
-def mutation(genome: Genome, num: int = 1, probability: float = 0.5) -> Genome:
-    for _ in range(num):
-        index = randrange(len(genome))
-        genome[index] = genome[index] if random() > probability else abs(genome[index] - 1)
+def mutation(genome: Genome, length: int, num: int = 1, probability: float = 0.5) -> Genome:
+    index = np.random.randint(length, size=num)
+    index = index[np.random.random(num) <= probability]
+    np.bitwise_xor.at(genome, index >> 6, np.uint64(1) << (index & 63).astype(np.uint64))
     return genome
 
 
@@ -49,6 +67,14 @@ def selection_pair(population: Population, fitness_func: FitnessFunc) -> Populat
     )
 
 
+def weighted_selection_pair(population: Population, fits: np.ndarray) -> Population:
+    weights = np.maximum(np.asarray(fits, dtype=np.int64) + 1, 0).astype(np.float64)
+    first = np.random.choice(len(population), p=weights / weights.sum())
+    weights[first] -= 1
+    second = np.random.choice(len(population), p=weights / weights.sum())
+    return [population[first], population[second]]
+
+
 def generate_weighted_distribution(population: Population, fitness_func: FitnessFunc) -> Population:
     result = []
 
@@ -58,20 +84,26 @@ def generate_weighted_distribution(population: Population, fitness_func: Fitness
     return result
 
 
-def genome_to_string(genome: Genome) -> str:
-    return "".join(map(str, genome))
+def genome_to_string(genome: Genome, length: int) -> str:
+    return "".join(map(str, unpack_genome(genome, length)))
 
 
 def run_evolution(
         populate_func: PopulateFunc,
         fitness_func: FitnessFunc,
         fitness_limit: int,
+        genome_length: int,
         selection_func: SelectionFunc = selection_pair,
-        crossover_func: CrossoverFunc = single_point_crossover,
-        mutation_func: MutationFunc = mutation,
+        crossover_func: Optional[CrossoverFunc] = None,
+        mutation_func: Optional[MutationFunc] = None,
         generation_limit: int = 100,
         printer: Optional[PrinterFunc] = None) \
         -> Tuple[Population, int]:
+    if crossover_func is None:
+        crossover_func = partial(single_point_crossover, length=genome_length)
+    if mutation_func is None:
+        mutation_func = partial(mutation, length=genome_length)
+
     population = populate_func()
 
     i = 0
@@ -5,10 +5,24 @@ Using Genetic Algorithms to create melodies
 import click
 # Click is a Python package for creating beautiful command line interfaces
 # in a composable way with as little code as necessary.
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+# concurrent.futures runs functions asynchronously, here on a pool of worker processes.
 from datetime import datetime
 # The datetime module supplies classes for manipulating dates and times.
-from typing import List, Dict
+from functools import lru_cache, partial
+# functools provides lru_cache, which remembers the results of a function for the arguments it was called with, and
+# partial, which fixes some of the arguments of a function.
+import io
+# io provides in-memory binary streams, used to put MIDI files together before writing them.
+from typing import Callable, Dict, List
 # Typing defines a standard notation for Python function and variable type annotations.
+import numpy as np
+# NumPy is the fundamental package for array computing with Python.
+try:
+    from numba import njit
+    # Numba is an optional just-in-time compiler that turns numerical Python loops into machine code.
+except ImportError:
+    njit = None
 from midiutil import MIDIFile
 # MIDIUtil is a pure Python library that allows one to write multi-track Musical Instrument Digital Interface (MIDI)
 # files from within Python programs.
@@ -21,7 +35,8 @@ from pyo import *
 # in order to produce offspring of the next generation.
 
 # This is another program named "genetic.py" from where we are importing functions that we made to use in this program.
-from Backbone import generate_genome, Genome, selection_pair, single_point_crossover, mutation
+from Backbone import generate_genome, Genome, Population, weighted_selection_pair, single_point_crossover, mutation, \
+    unpack_genome
 
 # The default number of bits per note.
 BITS_PER_NOTE = 4
@@ -29,82 +44,180 @@ BITS_PER_NOTE = 4
 KEYS = ["C", "C#", "Db", "D", "D#", "Eb", "E", "F", "F#", "Gb", "G", "G#", "Ab", "A", "A#", "Bb", "B"]
 # The scales in the melody can be made.
 SCALES = ["major", "minorM", "dorian", "lydian", "majorBlues", "minorBlues"]
+# The value of each bit of a note, the first bit being the least significant one.
+NOTE_WEIGHTS = 1 << np.arange(BITS_PER_NOTE, dtype=np.int64)
 
 
-# Takes integers and stores it so that it con be used in the "genome_to_melody" function
-def int_from_bits(bits: List[int]) -> int:
-    return int(sum([bit * pow(2, index) for index, bit in enumerate(bits)]))
+# Takes rows of bits (one row per note) and turns every row into an integer with a single dot product.
+def int_from_bits(bits: np.ndarray) -> np.ndarray:
+    return np.asarray(bits, dtype=np.uint8).dot(NOTE_WEIGHTS)
 
 
-# This function converts the genome to a melody.
-def genome_to_melody(genome: Genome, num_bars: int, num_notes: int, num_steps: int,
-                     pauses: int, key: str, scale: str, root: int) -> Dict[str, list]:
-    notes = [genome[i * BITS_PER_NOTE:i * BITS_PER_NOTE + BITS_PER_NOTE] for i in range(num_bars * num_notes)]
+# Decodes the notes of a genome with NumPy, without branching on any single note.
+def _bits_to_notes_beats_numpy(genome_arr: np.ndarray, num_notes_total: int, note_length: float,
+                               pauses: bool) -> (np.ndarray, np.ndarray, np.ndarray):
+    integers = int_from_bits(genome_arr[:num_notes_total * BITS_PER_NOTE].reshape(-1, BITS_PER_NOTE))
 
-    note_length = 4 / float(num_notes)
+    half = 1 << (BITS_PER_NOTE - 1)
+    if not pauses:
+        integers &= half - 1
+    is_pause = integers >= half
+    values = np.where(is_pause, 0, integers)
 
-    scl = EventScale(root=key, scale=scale, first=root)
+    # A note that repeats the value before it (a pause counts as 0) is merged into it, so only the first note of
+    # every run starts a new note and the beats of the run are summed up.
+    starts = np.flatnonzero(is_pause | (np.diff(values, prepend=-1) != 0))
+    if len(starts) == 0:
+        return values, values, np.zeros(0, dtype=np.float64)
 
-    melody = {
-        "notes": [],
-        "velocity": [],
-        "beat": []
-    }
+    notes = values[starts]
+    velocity = np.where(is_pause, 0, 127)[starts]
+    beat = np.add.reduceat(np.full(len(values), note_length, dtype=np.float64), starts)
+    return notes, velocity, beat
 
-    # Takes the integers from "int_from_bits" and sends it to the main function to be sent to the pyo server.
-    for note in notes:
-        integer = int_from_bits(note)
 
-        if not pauses:
-            integer = int(integer % pow(2, BITS_PER_NOTE - 1))
+# Decodes the notes of a genome one bit at a time, this is what numba compiles when it is installed.
+def _bits_to_notes_beats_loop(genome_arr: np.ndarray, num_notes_total: int, note_length: float,
+                              pauses: bool) -> (np.ndarray, np.ndarray, np.ndarray):
+    notes = np.empty(num_notes_total, dtype=np.int64)
+    velocity = np.empty(num_notes_total, dtype=np.int64)
+    beat = np.empty(num_notes_total, dtype=np.float64)
+    half = 1 << (BITS_PER_NOTE - 1)
 
-        if integer >= pow(2, BITS_PER_NOTE - 1):
-            melody["notes"] += [0]
-            melody["velocity"] += [0]
-            melody["beat"] += [note_length]
-        else:
-            if len(melody["notes"]) > 0 and melody["notes"][-1] == integer:
-                melody["beat"][-1] += note_length
-            else:
-                melody["notes"] += [integer]
-                melody["velocity"] += [127]
-                melody["beat"] += [note_length]
-
-    steps = []
-    for step in range(num_steps):
-        steps.append([scl[(note + step * 2) % len(scl)] for note in melody["notes"]])
+    count = 0
+    for i in range(num_notes_total):
+        integer = 0
+        for bit in range(BITS_PER_NOTE):
+            integer += np.int64(genome_arr[i * BITS_PER_NOTE + bit]) << bit
 
-    melody["notes"] = steps
+        if not pauses:
+            integer %= half
+
+        if integer >= half:
+            notes[count] = 0
+            velocity[count] = 0
+            beat[count] = note_length
+            count += 1
+        elif count > 0 and notes[count - 1] == integer:
+            beat[count - 1] += note_length
+        else:
+            notes[count] = integer
+            velocity[count] = 127
+            beat[count] = note_length
+            count += 1
+
+    return notes[:count], velocity[:count], beat[:count]
+
+
+# Turns the bits of a genome into notes, velocities and beats, repeated notes are merged into one longer note. The
+# module built by "build_aot.py" is used when it is there, so nothing has to be compiled when SoundForge starts.
+try:
+    from sf_native import bits_to_notes as _bits_to_notes_beats
+except ImportError:
+    _bits_to_notes_beats = njit(cache=True)(_bits_to_notes_beats_loop) if njit is not None \
+        else _bits_to_notes_beats_numpy
+
+
+# The notes of the scales that were already built, keyed by (key, scale, root). The worker processes get theirs from
+# "_init_worker", so they don't have to build the pyo scale themselves.
+_SCALES = {}
+
+
+# The notes of a scale only depend on the key, the scale and the root, which don't change during a run, so the pyo
+# scale is built once and its notes are kept as a (read-only) NumPy array.
+def _get_scale(key: str, scale: str, root: int) -> np.ndarray:
+    if (key, scale, root) not in _SCALES:
+        scl = EventScale(root=key, scale=scale, first=root)
+        scale_arr = np.array([scl[i] for i in range(len(scl))], dtype=np.int16)
+        scale_arr.setflags(write=False)
+        _SCALES[(key, scale, root)] = scale_arr
+    return _SCALES[(key, scale, root)]
+
+
+# Runs once in every worker process when it starts. It seeds NumPy's random generator again, forked workers would
+# otherwise all mutate the genomes the same way, and stores the scale the main process already built.
+def _init_worker(key: str, scale: str, root: int, scale_arr: np.ndarray):
+    np.random.seed()
+    scale_arr.setflags(write=False)
+    _SCALES[(key, scale, root)] = scale_arr
+
+
+# Works out the pitches of every step (one row per step), the velocities and the beats of a genome as arrays. Besides
+# the key, scale and root it takes the number of notes, their length, whether there are pauses and how far every step
+# is moved up the scale, which "make_arrays_fn" works out from the options.
+def genome_to_arrays(genome: Genome, key: str, scale: str, root: int, num_notes_total: int, note_length: float,
+                     pauses: bool, step_offsets: np.ndarray) -> (np.ndarray, np.ndarray, np.ndarray):
+    # The genome is packed 64 bits to a word, the bits of the notes are taken out of it here.
+    bits = unpack_genome(genome, num_notes_total * BITS_PER_NOTE)
+
+    scale_arr = _get_scale(key, scale, root)
+
+    # The bit twiddling happens in "_bits_to_notes_beats", the scale only gets applied afterwards since pyo objects
+    # can't be compiled by numba.
+    notes, velocity, beat = _bits_to_notes_beats(bits, num_notes_total, note_length, pauses)
+    # Every step is the melody moved up two notes of the scale, all the steps are looked up in the scale at once.
+    pitch_matrix = scale_arr[(notes[None, :] + step_offsets) % len(scale_arr)]
+    return pitch_matrix, velocity, beat
+
+
+# Binds all the arguments of "genome_to_arrays" that stay the same for a whole run, so it only has to be called with
+# the genome. This only saves working out the arguments again for every genome, nothing is compiled for them. It is a
+# partial instead of a closure so it can be sent to the workers, where it is sent along with every task.
+def make_arrays_fn(num_bars: int, num_notes: int, num_steps: int, pauses: bool, key: str, scale: str,
+                   root: int) -> Callable[[Genome], tuple]:
+    return partial(genome_to_arrays, key=key, scale=scale, root=root, num_notes_total=num_bars * num_notes,
+                   note_length=4 / float(num_notes), pauses=bool(pauses),
+                   step_offsets=2 * np.arange(num_steps, dtype=np.int64)[:, None])
+
+
+# This function converts the genome to a melody made of plain lists, which is what pyo takes. "arrays_fn" is a function
+# made by "make_arrays_fn".
+def genome_to_melody(arrays_fn: Callable[[Genome], tuple], genome: Genome) -> Dict[str, list]:
+    pitch_matrix, velocity, beat = arrays_fn(genome)
+    melody = {
+        "notes": pitch_matrix.tolist(),
+        "velocity": velocity.tolist(),
+        "beat": beat.tolist()
+    }
     return melody
 
 
-# This function is used to convert the genome to melody by sending it to the pyo server in the main function.
-def genome_to_events(genome: Genome, num_bars: int, num_notes: int, num_steps: int,
-                     pauses: bool, key: str, scale: str, root: int, bpm: int) -> [Events]:
-    melody = genome_to_melody(genome, num_bars, num_notes, num_steps, pauses, key, scale, root)
-
-    return [
+# The events playing the melodies, one per step. They are built once for a number of steps and a bpm and then reused
+# for every melody, so pyo doesn't have to set up new objects each time a melody is played.
+@lru_cache(maxsize=None)
+def _get_events(num_steps: int, bpm: int) -> tuple:
+    return tuple(
         Events(
-            midinote=EventSeq(step, occurrences=1),
-            midivel=EventSeq(melody["velocity"], occurrences=1),
-            beat=EventSeq(melody["beat"], occurrences=1),
+            midinote=EventSeq([0], occurrences=1),
+            midivel=EventSeq([0], occurrences=1),
+            beat=EventSeq([0], occurrences=1),
             attack=0.001,
             decay=0.05,
             sustain=0.5,
             release=0.005,
             bpm=bpm
-        ) for step in melody["notes"]
-    ]
+        ) for _ in range(num_steps)
+    )
+
 
+# Turns a melody that was already worked out into events that can be played by the pyo server. The events are shared,
+# so they play the melody of the last call, the sequences start over every time the events are played.
+def melody_to_events(melody: Dict[str, list], bpm: int) -> [Events]:
+    events = _get_events(len(melody["notes"]), bpm)
+    for e, step in zip(events, melody["notes"]):
+        e["midinote"].values = step
+        e["midivel"].values = melody["velocity"]
+        e["beat"].values = melody["beat"]
+    return list(events)
 
-# Rating the melody genomes after they come to the "genome_to_events" function.
-def fitness(genome: Genome, s: Server, num_bars: int, num_notes: int, num_steps: int,
-            pauses: bool, key: str, scale: str, root: int, bpm: int) -> int:
-    m = metronome(bpm)
+
+# Rating the melody genomes after they come to the "genome_to_melody" function.
+def fitness(melody: Dict[str, list], s: Server, bpm: int) -> int:
+    m = metronome(bpm).out()
     print("\nLets see if you like what the Algorithm cooked up for you!!!!!")
     print("You can rate the track between 0 and 5, cause you don't want the Algorithm to think that it created the "
           "next big banger!\n")
-    events = genome_to_events(genome, num_bars, num_notes, num_steps, pauses, key, scale, root, bpm)
+    events = melody_to_events(melody, bpm)
     for e in events:
         e.play()
     s.start()
@@ -113,6 +226,7 @@ def fitness(genome: Genome, s: Server, num_bars: int, num_notes: int, num_steps:
 
     for e in events:
         e.stop()
+    m.stop()
     s.stop()
     time.sleep(1)
 
@@ -125,21 +239,131 @@ def fitness(genome: Genome, s: Server, num_bars: int, num_notes: int, num_steps:
     return rating
 
 
-# Plays the metronome
+# Rates a melody without playing it, used by the headless mode. Melodies moving in small steps (up to a major third)
+# get rated higher, the rating goes from 0 to 5 just like the one given by the user.
+def headless_fitness(arrays_fn: Callable[[Genome], tuple], genome: Genome) -> int:
+    pitch_matrix, velocity, _ = arrays_fn(genome)
+
+    pitches = pitch_matrix[0][velocity > 0]
+    if len(pitches) < 2:
+        return 0
+
+    return int(round(5 * np.mean(np.abs(np.diff(pitches)) <= 4)))
+
+
+# Takes a tuple of the options of "headless_fitness" so it can be mapped over the worker processes.
+def evaluate_genome(args: tuple) -> int:
+    return headless_fitness(*args)
+
+
+# Takes a tuple of two parents, the number of mutations, the mutation probability and the number of bits in a genome
+# and returns their two offspring.
+def breed_offspring(args: tuple) -> (Genome, Genome):
+    parents, num_mutations, mutation_probability, genome_length = args
+    # "single_point_crossover" it takes a single node from each parents and puts it into the offspring
+    offspring_a, offspring_b = single_point_crossover(parents[0], parents[1], genome_length)
+    # Here we just mutate both the offsprings.
+    offspring_a = mutation(offspring_a, genome_length, num=num_mutations, probability=mutation_probability)
+    offspring_b = mutation(offspring_b, genome_length, num=num_mutations, probability=mutation_probability)
+    return offspring_a, offspring_b
+
+
+# Sorts the population and its ratings from the highest to the lowest rating. A stable sort keeps genomes with the
+# same rating in their order.
+def sort_by_fitness(population: Population, fits: np.ndarray) -> (Population, np.ndarray):
+    order = np.argsort(-fits, kind="stable")
+    return [population[i] for i in order], fits[order]
+
+
+# Evolves one island of the island model with "headless_fitness" for a number of breeding rounds and returns its
+# population sorted from the highest to the lowest rating, together with the ratings. Takes a tuple so it can be
+# mapped over the worker processes, the ratings in it can be None when the population wasn't rated yet. The genomes
+# are turned into melodies by a function made by "make_arrays_fn".
+def run_island(args: tuple) -> (Population, np.ndarray):
+    population, fits, rounds, arrays_fn, genome_length, num_mutations, mutation_probability = args
+
+    if fits is None:
+        fits = np.array([headless_fitness(arrays_fn, genome) for genome in population], dtype=np.int64)
+
+    for _ in range(rounds):
+        population, fits = sort_by_fitness(population, fits)
+        next_generation = population[0:2]
+        for _ in range(int(len(population) / 2) - 1):
+            next_generation += breed_offspring((weighted_selection_pair(population, fits), num_mutations,
+                                                mutation_probability, genome_length))
+        population = next_generation
+        fits = np.array([headless_fitness(arrays_fn, genome) for genome in population], dtype=np.int64)
+
+    return sort_by_fitness(population, fits)
+
+
+# Evolves a number of populations (islands) side by side on the worker processes. Just like the headless mode without
+# islands, every island goes through "generations" populations numbered from 0, so the first one is the random one.
+# Every "migration_interval" generations the two best genomes of every island move over to the next island, where they
+# replace the two worst ones. The islands are saved to MIDI files under the number of their population after every
+# migration and at the end, wait on the returned futures to know when the files are written.
+def run_islands(pool: Executor, folder: str, islands: int, generations: int, migration_interval: int,
+                population_size: int, genome_length: int, arrays_fn: Callable[[Genome], tuple], key: str, scale: str,
+                num_mutations: int, mutation_probability: float, bpm: int) -> List[Future]:
+    populations = [[generate_genome(genome_length) for _ in range(population_size)] for _ in range(islands)]
+    island_fits = [None] * islands
+    saves = []
+
+    population_id = 0
+    while True:
+        # The first call also rates the random populations, with "--generations 1" that is all it does.
+        interval = min(migration_interval, generations - 1 - population_id)
+        results = list(pool.map(run_island, [
+            (population, fits, interval, arrays_fn, genome_length, num_mutations, mutation_probability)
+            for population, fits in zip(populations, island_fits)
+        ]))
+        populations = [population for population, _ in results]
+        island_fits = [fits for _, fits in results]
+        population_id += interval
+
+        print(f"\nPopulation {population_id} done.")
+        for i, (population, fits) in enumerate(results):
+            print(f"Island {i} highest rating: {fits[0]}")
+            saves += save_population_to_midi(pool, f"{folder}/island-{i}", population_id, population, arrays_fn, key,
+                                             scale, bpm)
+
+        if population_id + 1 >= generations:
+            return saves
+
+        # Island i receives the best genomes of island i - 1, the first island those of the last one.
+        elites = [(population[0:2], fits[0:2]) for population, fits in results]
+        for i in range(islands):
+            migrants, migrant_fits = elites[i - 1]
+            populations[i] = populations[i][:-len(migrants)] + migrants
+            island_fits[i] = np.concatenate((island_fits[i][:-len(migrants)], migrant_fits))
+
+
+# The parts of the metronome that don't depend on when it starts, the shape of a click and the output, are only built
+# once and reused for every melody.
+@lru_cache(maxsize=None)
+def _metronome_output() -> (CosTable, Sine, PyoObject):
+    t = CosTable([(0, 0), (50, 1), (200, .3), (500, 0)])
+    osc = Sine(freq=440, mul=0)
+    return t, osc, osc.mix(2)
+
+
+# Builds the metronome, it is sent to the output with ".out()" every time it has to play. The Metro and the clicks
+# driven by it are built again for every melody, so the first (accented) click always lands on the first beat.
 def metronome(bpm: int):
+    t, osc, output = _metronome_output()
     met = Metro(time=1 / (bpm / 60.0)).play()
-    t = CosTable([(0, 0), (50, 1), (200, .3), (500, 0)])
     amp = TrigEnv(met, table=t, dur=.25, mul=1)
     freq = Iter(met, choice=[660, 440, 440, 440])
-    return Sine(freq=freq, mul=amp).mix(2).out()
+    osc.setFreq(freq)
+    osc.setMul(amp)
+    return output
 
 
-# Saves all the melodies to MIDI files in a directory in a best to worst order.
-def save_genome_to_midi(filename: str, genome: Genome, num_bars: int, num_notes: int, num_steps: int,
-                        pauses: bool, key: str, scale: str, root: int, bpm: int):
-    melody = genome_to_melody(genome, num_bars, num_notes, num_steps, pauses, key, scale, root)
+# Turns the genome into the contents of a MIDI file, "arrays_fn" is a function made by "make_arrays_fn".
+def genome_to_midi(arrays_fn: Callable[[Genome], tuple], genome: Genome, bpm: int) -> bytes:
+    pitch_matrix, velocities, beats = arrays_fn(genome)
 
-    if len(melody["notes"][0]) != len(melody["beat"]) or len(melody["notes"][0]) != len(melody["velocity"]):
+    if pitch_matrix.shape[1] != len(beats) or pitch_matrix.shape[1] != len(velocities):
         raise ValueError
 
     mf = MIDIFile(1)
@@ -151,59 +375,140 @@ def save_genome_to_midi(filename: str, genome: Genome, num_bars: int, num_notes:
     mf.addTrackName(track, time, "Sample Track")
     mf.addTempo(track, time, bpm)
 
-    for i, vel in enumerate(melody["velocity"]):
-        if vel > 0:
-            for step in melody["notes"]:
-                mf.addNote(track, channel, step[i], time, melody["beat"][i], vel)
-
-        time += melody["beat"][i]
-
+    # The start time, length and velocity of every note are worked out as arrays, pauses are left out. Every note
+    # starts where the one before it ends, so the start times are the running sum of the beats before them. The
+    # pitches of the notes that are played are taken out of the pitch matrix for all the steps at once.
+    times = np.empty_like(beats)
+    times[:1] = time
+    np.cumsum(beats[:-1], out=times[1:])
+    active_idx = np.flatnonzero(velocities > 0)
+    starts = times[active_idx].tolist()
+    durations = beats[active_idx].tolist()
+    vels = velocities[active_idx].tolist()
+    active_pitches = pitch_matrix[:, active_idx].tolist()
+
+    add_note = mf.addNote
+    for pitches in active_pitches:
+        for pitch, start, duration, vel in zip(pitches, starts, durations, vels):
+            add_note(track, channel, pitch, start, duration, vel)
+
+    # The file is put together in memory, so it can be written with a single write.
+    buffer = io.BytesIO()
+    mf.writeFile(buffer)
+    return buffer.getvalue()
+
+
+# Writes the contents of a MIDI file, the directory is created if it doesn't exist yet.
+def write_midi_file(filename: str, data: bytes):
     os.makedirs(os.path.dirname(filename), exist_ok=True)
     with open(filename, "wb") as f:
-        mf.writeFile(f)
+        f.write(data)
+
+
+# Saves all the melodies to MIDI files in a directory in a best to worst order.
+def save_genome_to_midi(filename: str, arrays_fn: Callable[[Genome], tuple], genome: Genome, bpm: int):
+    write_midi_file(filename, genome_to_midi(arrays_fn, genome, bpm))
+
+
+# Saves every genome of the population to its own MIDI file on the worker processes, wait on the returned futures to
+# know when the files are written. The genomes are turned into melodies by a function made by "make_arrays_fn".
+def save_population_to_midi(pool: Executor, folder: str, population_id: int, population: Population,
+                            arrays_fn: Callable[[Genome], tuple], key: str, scale: str, bpm: int) -> List[Future]:
+    return [
+        pool.submit(save_genome_to_midi, f"{folder}/{population_id}/{key}-{scale}-{bpm}-{i}.mid", arrays_fn,
+                    genome, bpm) for i, genome in enumerate(population)
+    ]
+
+
+# An option that is only asked for when SoundForge isn't running headless, the headless mode takes the default value
+# instead so it can run without anyone typing in the answers. "--headless" is eager, so it is known before the prompts.
+class InteractiveOption(click.Option):
+    def prompt_for_value(self, ctx: click.Context):
+        if ctx.params.get("headless"):
+            return self.get_default(ctx)
+        return super().prompt_for_value(ctx)
 
 
 @click.command()
 # Number of bars, default value is 4.
 @click.option("--num-bars", default=4, prompt='How many number of bars do you want in your track, not sure? nevermind '
-                                              'the default value will save you\n', type=int)
+                                              'the default value will save you\n', type=int, cls=InteractiveOption)
 # Number of notes per bar, default is 8.
 @click.option("--num-notes", default=8, prompt='\nHow many notes per bar do you need?? Unsure??? Just click enter and '
-                                               'the default value will select a value for you\n', type=int)
+                                               'the default value will select a value for you\n', type=int,
+              cls=InteractiveOption)
 # Number of steps (asks you whether you want to generate chords or just melodies).
 @click.option("--num-steps", default=1, prompt='\nNumber of steps, pssttt the default value will make an 8-bit melody '
-                                               'for you, you can use any other number other than 1\n', type=int)
+                                               'for you, you can use any other number other than 1\n', type=int,
+              cls=InteractiveOption)
 # Asks you whether you want to introduce pauses.
-@click.option("--pauses", default=False, prompt='\nDo you like pauses in your melodies??\n', type=bool)
+@click.option("--pauses", default=False, prompt='\nDo you like pauses in your melodies??\n', type=bool,
+              cls=InteractiveOption)
 # Asks you the key you wan the melody to be in, default key is C.
 @click.option("--key", default="C", prompt='\nChoose the Key you want your melody too be in, there is already a '
                                            'default value preset\n',
-              type=click.Choice(KEYS, case_sensitive=False))
+              type=click.Choice(KEYS, case_sensitive=False), cls=InteractiveOption)
 # Asks you the scale of the melody and the default value is a major.
 @click.option("--scale", default="major", prompt='\nWhat Scale do you want your melody to be in, default value is '
                                                  'already set\n',
-              type=click.Choice(SCALES, case_sensitive=False))
+              type=click.Choice(SCALES, case_sensitive=False), cls=InteractiveOption)
 # How high should the scale go, default is 4 octaves high.
-@click.option("--root", default=4, prompt='\nChoose your Octave, How high do you want the scale to go??\n', type=int)
+@click.option("--root", default=4, prompt='\nChoose your Octave, How high do you want the scale to go??\n', type=int,
+              cls=InteractiveOption)
 # How many different melodies should be generated, default value is 4.
-@click.option("--population-size", default=4, prompt='\nHow many melodies do you want in each population?\n', type=int)
+@click.option("--population-size", default=4, prompt='\nHow many melodies do you want in each population?\n', type=int,
+              cls=InteractiveOption)
 # How many mutations should each generation have, default value is 2.
 @click.option("--num-mutations", default=2, prompt='\nNumber of mutations (Yeah, your beat is now a part of the '
-                                                   'X-Men)\n', type=int)
+                                                   'X-Men)\n', type=int, cls=InteractiveOption)
 # The probability of mutating a random node, default probability is 50%.
 @click.option("--mutation-probability", default=0.5, type=float)
 # BPM of the song, default value is 128bpm.
 @click.option("--bpm", default=128, prompt='\n128 is the standard bpm, but you can increase or decrease it\n',
-              type=int)
+              type=int, cls=InteractiveOption)
+# Rates the melodies with "headless_fitness" instead of playing them, and saves every population without asking.
+# Nothing is asked for either, the options that aren't given take their default values.
+@click.option("--headless", is_flag=True, default=False, is_eager=True)
+# Number of populations rated in the headless mode, the first one is random, default value is 10.
+@click.option("--generations", default=10, type=click.IntRange(min=1))
+# Number of populations evolved side by side in the headless mode, default value is 1 (no islands).
+@click.option("--islands", default=1, type=click.IntRange(min=1))
+# Number of generations between the migrations of genomes from one island to the next, default value is 5.
+@click.option("--migration-interval", default=5, type=click.IntRange(min=1))
 # All the above options are injected into the main function below.
 def main(num_bars: int, num_notes: int, num_steps: int, pauses: bool, key: str, scale: str, root: int,
-         population_size: int, num_mutations: int, mutation_probability: float, bpm: int):
+         population_size: int, num_mutations: int, mutation_probability: float, bpm: int, headless: bool,
+         generations: int, islands: int, migration_interval: int):
+    if islands > 1 and not headless:
+        raise click.UsageError("--islands can only be used together with --headless")
+
     # This creates a folder where all the MIDI files are stored.
     folder = str(int(datetime.now().timestamp()))
     # Here we start to generate a random genome melody.
-    population = [generate_genome(num_bars * num_notes * BITS_PER_NOTE) for _ in range(population_size)]
+    genome_length = num_bars * num_notes * BITS_PER_NOTE
+    population = [generate_genome(genome_length) for _ in range(population_size)]
+    # The melodies are always worked out with the same options during a run, for the ratings, the tracks played and
+    # the MIDI files alike.
+    arrays_fn = make_arrays_fn(num_bars, num_notes, num_steps, pauses, key, scale, root)
+    # The worker processes take the Python work (melodies, ratings, offspring and MIDI files) off the main process.
+    # They are started once and kept for the whole run, so their start-up cost is only paid once.
+    pool = ProcessPoolExecutor(max_workers=os.cpu_count(), initializer=_init_worker,
+                               initargs=(key, scale, root, _get_scale(key, scale, root)))
+    # The pool only starts its workers with the first task, which would fork them off a process with the pyo server
+    # running. An empty task starts them here, before the server below is booted.
+    pool.submit(int).result()
+
+    # With more than one island the populations are evolved by "run_islands" instead of the loop below.
+    if islands > 1:
+        for save in run_islands(pool, folder, islands, generations, migration_interval, population_size, genome_length,
+                                arrays_fn, key, scale, num_mutations, mutation_probability, bpm):
+            save.result()
+        pool.shutdown()
+        return
     # This server refers to the pyo library server, which is required to be initiated to generate sounds.
-    s = Server().boot()
+    s = None if headless else Server().boot()
+    # The MIDI files being saved in the background, they are all waited on before leaving.
+    saves = []
 
     population_id = 0
     # Asks whether you want to continue generating melodies in the next generation.
@@ -211,40 +516,48 @@ def main(num_bars: int, num_notes: int, num_steps: int, pauses: bool, key: str,
     while running:
         # All the generated genomes are shuffled and put in a random order.
         random.shuffle(population)
-        # Evaluates the fitness of the current genome. This "population_fitness" is sent over to the fitness function
-        # and then we rate it.
-        population_fitness = [
-            (genome, fitness(genome, s, num_bars, num_notes, num_steps, pauses, key, scale, root, bpm)) for genome in
-            population]
-        # Here we sort it.
-        sorted_population_fitness = sorted(population_fitness, key=lambda e: e[1], reverse=True)
-        # Now we generate our new generation.
-        population = [e[0] for e in sorted_population_fitness]
+        # Evaluates the fitness of the current genome. The genomes are sent over to the fitness function and then we
+        # rate them, "fits" holds the ratings in the same order as the population.
+        if headless:
+            fits = np.fromiter(pool.map(evaluate_genome, [(arrays_fn, genome) for genome in population]),
+                               dtype=np.int64)
+        else:
+            # The melodies are worked out on the worker processes while the user listens to the ones before them.
+            # They are kept by the identity of the genome so the highest rated tracks can be played without working
+            # them out again.
+            melodies = {id(genome): pool.submit(genome_to_melody, arrays_fn, genome) for genome in population}
+            fits = np.array([fitness(melodies[id(genome)].result(), s, bpm) for genome in population], dtype=np.int64)
+        # Here we sort it, highest rating first, and now we generate our new generation.
+        population, fits = sort_by_fitness(population, fits)
         # here we just take two elements from the previous generation and just put them in the next generation.
         next_generation = population[0:2]
 
         # We take the number of the population divide it by 2 and minus 1 from it, to get genomes for the parents
-        # of the next generation.
-        for j in range(int(len(population) / 2) - 1):
-
-            def fitness_lookup(genome):
-                for e in population_fitness:
-                    if e[0] == genome:
-                        return e[1]
-                return 0
-
-            parents = selection_pair(population, fitness_lookup)
-            # "single_point_crossover" it takes a single node from each parents and puts it into the offspring
-            offspring_a, offspring_b = single_point_crossover(parents[0], parents[1])
-            # Here we just mutate both the offsprings.
-            offspring_a = mutation(offspring_a, num=num_mutations, probability=mutation_probability)
-            offspring_b = mutation(offspring_b, num=num_mutations, probability=mutation_probability)
-            next_generation += [offspring_a, offspring_b]
+        # of the next generation. The parents are picked here with the sorted ratings, their offspring are bred on
+        # the worker processes while the user listens to the highest rated tracks and are only collected for the next
+        # generation.
+        parents = [weighted_selection_pair(population, fits) for _ in range(int(len(population) / 2) - 1)]
+        offspring = pool.map(breed_offspring, [(pair, num_mutations, mutation_probability, genome_length)
+                                               for pair in parents])
 
         print(f"\nPopulation {population_id} done.")
 
-        # This is how we send our genomes to the pyo server to get converted into music.
-        events = genome_to_events(population[0], num_bars, num_notes, num_steps, pauses, key, scale, root, bpm)
+        if headless:
+            print(f"Highest rating: {fits[0]}")
+            saves += save_population_to_midi(pool, folder, population_id, population, arrays_fn, key, scale, bpm)
+
+            if population_id + 1 >= generations:
+                break
+            population = next_generation + [genome for pair in offspring for genome in pair]
+            population_id += 1
+            continue
+
+        # The MIDI files of the population are put together ahead of time in case the user wants to save them.
+        midis = [pool.submit(genome_to_midi, arrays_fn, genome, bpm) for genome in population]
+
+        # This is how we send our genomes to the pyo server to get converted into music. The melodies were already
+        # worked out while rating, so there is no waiting before the tracks play.
+        events = melody_to_events(melodies[id(population[0])].result(), bpm)
         for e in events:
             e.play()
         s.start()
@@ -255,7 +568,7 @@ def main(num_bars: int, num_notes: int, num_steps: int, pauses: bool, key: str,
 
         time.sleep(1)
 
-        events = genome_to_events(population[1], num_bars, num_notes, num_steps, pauses, key, scale, root, bpm)
+        events = melody_to_events(melodies[id(population[1])].result(), bpm)
         for e in events:
             e.play()
         s.start()
@@ -269,10 +582,8 @@ def main(num_bars: int, num_notes: int, num_steps: int, pauses: bool, key: str,
         # Here is where the saving the audio file to MIDI happens.
         download = str(input("\nDo you want to save the entire population midi? [yes/no]: "))
         if download == "yes":
-            for i, genome in enumerate(population):
-                save_genome_to_midi(f"{folder}/{population_id}/{key}-{scale}-{bpm}-{i}.mid", genome, num_bars,
-                                    num_notes,
-                                    num_steps, pauses, key, scale, root, bpm)
+            for i, midi in enumerate(midis):
+                write_midi_file(f"{folder}/{population_id}/{key}-{scale}-{bpm}-{i}.mid", midi.result())
             print("\nDone!!")
         elif download == "no":
             print("\nPopulation will not be downloaded!")
@@ -281,21 +592,26 @@ def main(num_bars: int, num_notes: int, num_steps: int, pauses: bool, key: str,
 
         running = input("\nDo you want to continue to the next generation? [yes/no]: ")
         if running == "yes":
-            population = next_generation
+            population = next_generation + [genome for pair in offspring for genome in pair]
             population_id += 1
         elif running == "no":
             feedback = input("\nWas the algorithm able to make something that you liked? [yes/no]: ")
             if feedback == "yes":
                 print("\nThat's fantastic!!")
-                exit()
+                running = False
             elif feedback == "no":
                 print("\nI'm sorry that you couldn't find what you were looking for!!!")
-                exit()
+                running = False
             else:
                 print("Please enter yes or no.")
         else:
             print("Please enter yes or no.")
 
+    # Waits for the MIDI files that are still being saved, this also raises any error that happened while saving.
+    for save in saves:
+        save.result()
+    pool.shutdown()
+
 
 if __name__ == '__main__':
     print(
@@ -0,0 +1,22 @@
+"""
+Compiles the genome decoding loop of SoundForge ahead of time with numba
+"""
+
+import os
+# The os module is used to find the folder this file is in.
+from numba.pycc import CC
+# numba.pycc compiles Python functions into an extension module that can be imported without numba.
+
+# The loop is taken from SoundForge itself, so the compiled module always matches it.
+from SoundForge import _bits_to_notes_beats_loop
+
+# The compiled module is called "sf_native" and is written next to SoundForge.py, where SoundForge looks for it.
+cc = CC("sf_native")
+cc.output_dir = os.path.dirname(os.path.abspath(__file__))
+
+cc.export("bits_to_notes", "Tuple((int64[:], int64[:], float64[:]))(uint8[:], int64, float64, boolean)")(
+    _bits_to_notes_beats_loop)
+
+
+if __name__ == '__main__':
+    cc.compile()